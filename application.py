@@ -2,17 +2,41 @@
 """
 Template for SNAP Dash apps.
 """
+
 import os
 import datetime
+import logging
+import shutil
+import click
 import dash
 from dash.dependencies import Input, Output
 import plotly.graph_objs as go
 import flask
-from gui import layout, path_prefix
-from data import fetch_data
+from gui import layout, path_prefix, prerender_dir
+from data import fetch_data, decimate_overview
+from profiling import profiled
+import static_assets
 import luts
 
-app = dash.Dash(__name__, requests_pathname_prefix=path_prefix)
+CSV_FILENAME = "statewide_temperature_daily_index.csv"
+# Where the callback writes the CSV behind the "Download data" button.
+DOWNLOADS_DIR = "downloads"
+FIGURE_FILENAME = "daily_index.json"
+
+# Prerendered files only change when `flask export` runs (daily),
+# so let browsers and the CDN hold on to them for a while.
+PRERENDER_MAX_AGE = int(os.getenv("DASH_PRERENDER_MAX_AGE", default="3600"))
+
+if static_assets.manifest:
+    # Load the fingerprinted stylesheets instead of Dash's plain copies.
+    app = dash.Dash(
+        __name__,
+        requests_pathname_prefix=path_prefix,
+        assets_ignore=r".*\.css$",
+        external_stylesheets=[path_prefix + url for url in static_assets.stylesheets()],
+    )
+else:
+    app = dash.Dash(__name__, requests_pathname_prefix=path_prefix)
 
 # AWS Elastic Beanstalk looks for application by default,
 # if this variable (application) isn't set you will get a WSGI error.
@@ -30,24 +54,18 @@ def serve_static(path):
     return flask.send_from_directory(os.path.join(root_dir, "downloads"), path)
 
 
-# Input value added to allow for cache to be refreshed after becoming
-# invalid from the number of seconds indicated in data.py. This is set to
-# 43200 seconds by default.
-@app.callback(Output("daily-index", "figure"), [Input("cache_check_input", "value")])
-def update_daily_index(nonce):  # deliberate unused arg
-    """Generate precipitation scatter chart"""
-    start_date = (datetime.date.today() + datetime.timedelta(days=-180)).strftime(
-        "%Y-%m-%d"
-    )
-    end_date = (datetime.date.today() + datetime.timedelta(days=-1)).strftime(
-        "%Y-%m-%d"
-    )
+# Fingerprinted assets written by `flask build-assets`.
+@app.server.route(f"/{static_assets.DIST_DIR}/<path:path>")
+def serve_dist(path):
+    return static_assets.serve(path)
 
-    filename = "downloads/statewide_temperature_daily_index.csv"
-    di = fetch_data()
-    di.drop(columns=["count"]).rename(
-        columns={"date": "Date", "daily_index": "Daily Index"}
-    ).to_csv(filename, index=False, header=True)
+
+def build_figure(di, start_date, end_date):
+    """Build the daily index chart for the window start_date..end_date"""
+    # The rolling mean needs every day, so compute it before decimating
+    # the part of the history that's only visible in the rangeslider.
+    di = di.assign(rolling=di["daily_index"].rolling(30).mean().round(2))
+    di = decimate_overview(di, start_date)
     above = di[di.daily_index > 0]
     below = di[di.daily_index <= 0]
 
@@ -83,7 +101,7 @@ def update_daily_index(nonce):  # deliberate unused arg
             ),
             go.Scatter(
                 x=di["date"],
-                y=di["daily_index"].rolling(30).mean().round(2),
+                y=di["rolling"],
                 name="30-day Average   ",
                 hovertemplate="%{x} <br><b>30-day Average:</b> %{y}",
                 line=dict(shape="spline", color="#333"),
@@ -106,5 +124,131 @@ def update_daily_index(nonce):  # deliberate unused arg
     )
 
 
+def chart_window():
+    """Default visible window: the last 180 days up to yesterday"""
+    start_date = (datetime.date.today() + datetime.timedelta(days=-180)).strftime(
+        "%Y-%m-%d"
+    )
+    end_date = (datetime.date.today() + datetime.timedelta(days=-1)).strftime(
+        "%Y-%m-%d"
+    )
+    return start_date, end_date
+
+
+def write_csv(di, filename):
+    """Write the daily index as the downloadable CSV"""
+    di.drop(columns=["count"]).rename(
+        columns={"date": "Date", "daily_index": "Daily Index"}
+    ).to_csv(filename, index=False, header=True)
+
+
+if prerender_dir:
+    # Prerendered mode: the browser fetches the figure exported by
+    # `flask export` as a static file instead of running the chart
+    # callback.  The page shell and Dash's bundles still come from Flask.
+    @app.server.route("/prerendered/<path:path>")
+    def serve_prerendered(path):
+        return flask.send_from_directory(
+            os.path.abspath(prerender_dir), path, max_age=PRERENDER_MAX_AGE
+        )
+
+    app.clientside_callback(
+        f"""
+        function(nonce) {{
+            return fetch("{path_prefix}prerendered/{FIGURE_FILENAME}")
+                .then(function(response) {{
+                    if (!response.ok) {{
+                        return window.dash_clientside.no_update;
+                    }}
+                    return response.json();
+                }});
+        }}
+        """,
+        Output("daily-index", "figure"),
+        [Input("cache_check_input", "value")],
+    )
+
+else:
+    # Input value added to allow for cache to be refreshed after becoming
+    # invalid from the number of seconds indicated in data.py. This is set to
+    # 43200 seconds by default.
+    @app.callback(
+        Output("daily-index", "figure"), [Input("cache_check_input", "value")]
+    )
+    @profiled
+    def update_daily_index(nonce):  # deliberate unused arg
+        """Generate precipitation scatter chart"""
+        start_date, end_date = chart_window()
+        di = fetch_data()
+        write_csv(di, os.path.join(DOWNLOADS_DIR, CSV_FILENAME))
+        return build_figure(di, start_date, end_date)
+
+
+def write_atomic(path, write):
+    """Call write(tmp_path), then move the result into place atomically"""
+    tmp_path = path + ".tmp"
+    try:
+        write(tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+@app.server.cli.command("export")
+@click.argument("out_dir", default="prerendered")
+@click.option(
+    "--replace-preview",
+    is_flag=True,
+    help="Also copy the rendered PNG over assets/preview.png.",
+)
+def export(out_dir, replace_preview):
+    """Prerender the chart, CSV, HTML snapshot and preview image to OUT_DIR."""
+    os.makedirs(out_dir, exist_ok=True)
+    start_date, end_date = chart_window()
+    di = fetch_data()
+    fig = build_figure(di, start_date, end_date)
+
+    write_atomic(os.path.join(out_dir, CSV_FILENAME), lambda tmp: write_csv(di, tmp))
+    write_atomic(
+        os.path.join(out_dir, FIGURE_FILENAME),
+        lambda tmp: fig.write_json(tmp),
+    )
+    write_atomic(
+        os.path.join(out_dir, "index.html"),
+        lambda tmp: fig.write_html(
+            tmp, include_plotlyjs="cdn", config=luts.fig_configs
+        ),
+    )
+    logging.info("Wrote figure, CSV and HTML snapshot to %s", out_dir)
+
+    # Static image export needs the optional kaleido package (and, for
+    # kaleido 1.x, a Chrome install).  It fails in many ways, none of
+    # which should undo the export written above.
+    preview = os.path.join(out_dir, "preview.png")
+    try:
+        write_atomic(
+            preview,
+            lambda tmp: fig.write_image(
+                tmp, format="png", **luts.preview_image_configs
+            ),
+        )
+    except Exception:  # pylint: disable=broad-except
+        logging.exception(
+            "Skipping preview.png, are kaleido and Chrome installed? "
+            "(kaleido_get_chrome installs Chrome)"
+        )
+        return
+    if replace_preview:
+        shutil.copyfile(preview, "assets/preview.png")
+
+
+@app.server.cli.command("build-assets")
+def build_assets():
+    """Write fingerprinted, precompressed copies of assets/ to dist/."""
+    static_assets.build()
+
+
 if __name__ == "__main__":
     application.run(debug=os.getenv("FLASK_DEBUG", default=False), port=8080)
@@ -8,11 +8,15 @@ and caching community data.
 import urllib.parse
 import os
 import datetime
+import fcntl
 import logging
+import tempfile
+import numpy as np
 import pandas as pd
 from beaker.cache import CacheManager
 from beaker.util import parse_cache_config_options
 import scipy.stats
+from profiling import profiled
 
 DASH_LOG_LEVEL = os.getenv("DASH_LOG_LEVEL", default="info")
 logging.basicConfig(level=getattr(logging, DASH_LOG_LEVEL.upper(), logging.INFO))
@@ -27,6 +31,22 @@ cache_opts = {"cache.type": "memory"}
 
 cache = CacheManager(**parse_cache_config_options(cache_opts))
 
+# When set, the daily index is published to this .npy file and every
+# worker process memory-maps it instead of keeping its own copy.
+SHARED_DATA = os.getenv("DASH_SHARED_DATA", default=None)
+if SHARED_DATA:
+    logging.info("Sharing daily index through %s", SHARED_DATA)
+# After a failed refresh, keep serving the stale file this many seconds
+# before trying the upstream again.
+SHARED_RETRY = int(os.getenv("DASH_SHARED_RETRY", default="300"))
+
+# Point budget for the part of the chart outside the initially visible
+# window (what the rangeslider overview shows).  Above the current ~550
+# days of older history, so it only kicks in once the window grows.
+# Set to 0 to disable.
+OVERVIEW_POINTS = int(os.getenv("DASH_OVERVIEW_POINTS", default="1000"))
+logging.info("Overview point budget set to %s", OVERVIEW_POINTS)
+
 """
 List of Station IDs to Location:
 USW00026451=ANCHORAGE
@@ -64,10 +84,67 @@ STATION_IDS = os.getenv(
     "USW00025339",
 )
 
+# Station IDs are stored as categorical codes rather than repeated strings,
+# drawn from the weighted stations list rather than ACIS_STATION_IDS, which
+# may be spaced differently or use other ID types.
+STATION_DTYPE = pd.CategoricalDtype(pd.read_csv("data/StationsList.txt")["usw"])
+
+
+def day_keys(dates):
+    """
+    Month/day join key (e.g. 1231 for Dec 31st) for the normals,
+    accepts a DatetimeIndex or a Series' .dt accessor.
+    """
+    return (dates.month * 100 + dates.day).astype("int16")
 
+
+def log_memory_usage(stage, df):
+    """Log the in-memory footprint of a pipeline stage."""
+    logging.info(
+        "%s: %d rows, %.1f KiB",
+        stage,
+        len(df),
+        df.memory_usage(deep=True).sum() / 1024,
+    )
+
+
+def acis_query():
+    """
+    Start date and ACIS API URL for the last two years of daily
+    max/min temperatures at every station.
+    """
+    # Start date of two years ago
+    start_date = (datetime.date.today() + datetime.timedelta(days=-732)).strftime(
+        "%Y-%m-%d"
+    )
+
+    # End date yesterday
+    end_date = (datetime.date.today() + datetime.timedelta(days=-1)).strftime(
+        "%Y-%m-%d"
+    )
+
+    # Generate variable query for ACIS API call
+    query = urllib.parse.urlencode(
+        {
+            "sids": STATION_IDS,
+            "sdate": start_date,
+            "edate": end_date,
+            "elems": "1,2",  # Max temp, min temp
+            "output": "json",  # CSV now allowed for multi-day with multi-station
+        }
+    )
+
+    # Add ACIS API URL to generated query
+    return start_date, API_URL + query
+
+
+@profiled
 def build_daily_index(sd):
     # Remove any missing rows.
     sd = sd.dropna()
+    # load_api_data stores departures as float32 rounded to 3 places;
+    # recover the exact float64 values before averaging.
+    sd = sd.assign(depart_sd=sd["depart_sd"].astype("float64").round(3))
 
     # Pull in stations list including weights for generating daily_index
     stations = pd.read_csv("data/StationsList.txt")
@@ -97,12 +174,13 @@ def build_daily_index(sd):
         new_row = pd.DataFrame([{"date": day, "count": count, "daily_index": prob}])
         daily_index = pd.concat([daily_index, new_row], ignore_index=True)
 
-    daily_index["count"] = daily_index["count"].astype("int")
+    daily_index["count"] = daily_index["count"].astype("int16")
+    # Day ordinals back to dates for charting / CSV.
+    daily_index["date"] = pd.to_datetime(daily_index["date"], unit="D")
     return daily_index
 
 
-@cache.cache("fetch_api_data", type="memory", expire=CACHE_EXPIRE)
-def fetch_api_data():
+def load_api_data():
     """
     Reads data from ACIS API for selected community.
     """
@@ -111,44 +189,36 @@ def fetch_api_data():
         daily_index = pd.read_csv("data/test-daily-index.csv", index_col=0)
     else:
 
-        # Normals CSV for each station + date
+        # Normals CSV for each station + date, keyed by month/day
         normals = pd.read_csv("data/normals.csv", index_col=0)
-        normals["date"] = pd.to_datetime(normals["date"])
-
-        # Start date of two years ago
-        start_date = (datetime.date.today() + datetime.timedelta(days=-732)).strftime(
-            "%Y-%m-%d"
-        )
-
-        # End date yesterday
-        end_date = (datetime.date.today() + datetime.timedelta(days=-1)).strftime(
-            "%Y-%m-%d"
-        )
-
-        logging.info("Sending upstream data API request")
-
-        # Create a DataFrame to hold all station data
-        all_stations = pd.DataFrame()
-
-        # Generate variable query for ACIS API call
-        query = urllib.parse.urlencode(
+        normal_dates = pd.to_datetime(normals["date"])
+        normals = pd.DataFrame(
             {
-                "sids": STATION_IDS,
-                "sdate": start_date,
-                "edate": end_date,
-                "elems": "1,2",  # Max temp, min temp
-                "output": "json",  # CSV now allowed for multi-day with multi-station
+                "usw": normals["StationName"].astype(STATION_DTYPE),
+                "key": day_keys(normal_dates.dt),
+                # Kept as float64: they feed the departure calculation.
+                "AveTemp": normals["AveTemp"],
+                "AveTempSD": normals["AveTempSD"],
             }
         )
+        log_memory_usage("normals", normals)
 
-        # Add ACIS API URL to generated query
-        query = API_URL + query
+        start_date, query = acis_query()
+        logging.info("Sending upstream data API request")
 
         all_std = pd.read_json(query)
+        log_memory_usage("ACIS response", all_std)
 
         # Date Range indexing for 732 days for 2 years worth of data
         # TODO make the amount of periods dynamic
         daterange = pd.date_range(start_date, periods=732, freq="D")
+        # Dates are carried as days since the epoch, plus a month/day
+        # key for joining with the normals.
+        ordinals = daterange.to_numpy().astype("datetime64[D]").astype("int32")
+        keys = day_keys(daterange)
+
+        # Collect each station's frame and concatenate once at the end.
+        station_frames = []
         for row in all_std["data"]:
             # MultiStnData returns metadata in an indeterminate way from the JSON output.
             # This code searches the metadata list for the USW* station ID in the metadata.
@@ -156,57 +226,243 @@ def fetch_api_data():
 
             # Pull just the USW value from returned search in matching variable
             usw = matching[0].split(" ")[0]
-
-            # Create DataFrame for current station data
-            std = pd.DataFrame({"date": daterange, "usw": usw})
-
-            # DataFrame created from JSON data output from API call to ACIS
+            if usw not in STATION_DTYPE.categories:
+                logging.warning(
+                    "Station %s is not in data/StationsList.txt, skipping it", usw
+                )
+                continue
+
+            # DataFrame created from JSON data output from API call to ACIS,
+            # missing ("M") temperatures become NaN.
             data_df = pd.DataFrame(row["data"], columns=["maxt", "mint"])
+            data_df = data_df.apply(pd.to_numeric, errors="coerce").astype("float32")
 
             # Concatenate dates, USW value, and data (maxt, mint) into a single DataFrame
-            std = pd.concat([std, data_df], axis=1)
-
-            # Drop missing temperature values
-            std = std.loc[(std["maxt"] != "M") & (std["mint"] != "M")]
-
-            # Set types for station data columns
-            std["date"] = pd.to_datetime(std["date"])
-            std["maxt"] = std["maxt"].astype("float")
-            std["mint"] = std["mint"].astype("float")
+            std = pd.DataFrame(
+                {
+                    "date": ordinals,
+                    "key": keys,
+                    "usw": pd.Categorical([usw] * len(ordinals), dtype=STATION_DTYPE),
+                }
+            )
+            std = pd.concat([std, data_df], axis=1).dropna()
 
             # Create the average temperature from maximum and minimum temperature
-            std = std.assign(current_average=std[["maxt", "mint"]].mean(axis=1))
+            current_average = (std["maxt"].astype("float64") + std["mint"]) / 2
 
             # Subset for current location
-            nd = normals.loc[normals["StationName"] == usw]
-
-            # Make a current year date column to join with normals data properly
-            std = std.assign(
-                key_date=std["date"].apply(lambda dt: dt.replace(year=2020))
-            )
-            jd = std.set_index("key_date").join(nd.set_index("date"))
+            nd = normals.loc[normals["usw"] == usw].set_index("key")
+            jd = std.join(nd[["AveTemp", "AveTempSD"]], on="key")
 
             # Departure standard deviation (SD) =
             # (current average - normal average) / normal SD
-            jd = jd.assign(
-                depart_sd=(
-                    (jd["current_average"] - jd["AveTemp"]) / jd["AveTempSD"]
-                ).round(3)
-            )
-            # Drop StationName
-            jd = jd.drop(columns=["StationName"])
+            # Computed in float64, stored as float32; build_daily_index
+            # depends on this and re-rounds in float64 before averaging.
+            depart_sd = ((current_average - jd["AveTemp"]) / jd["AveTempSD"]).round(3)
+            jd = jd.assign(depart_sd=depart_sd.astype("float32"))
+            station_frames.append(jd[["date", "usw", "depart_sd"]])
+
+        del all_std
+        all_stations = pd.concat(station_frames, ignore_index=True)
+        del station_frames
+        log_memory_usage("station data", all_stations)
 
-            all_stations = pd.concat([all_stations, jd], ignore_index=True)
         daily_index = build_daily_index(all_stations)
+        log_memory_usage("daily index", daily_index)
 
     return daily_index
 
 
+@profiled
+@cache.cache("fetch_api_data", type="memory", expire=CACHE_EXPIRE)
+def fetch_api_data():
+    """
+    Per-process cached copy of load_api_data().
+    """
+    return load_api_data()
+
+
+# Record layout of the shared daily index file.
+SHARED_DTYPE = np.dtype(
+    [("date", "datetime64[ns]"), ("daily_index", "float64"), ("count", "int16")]
+)
+
+# The mapping this process currently holds, and the (inode, mtime)
+# of the file it was mapped from.
+shared_map = {"version": None, "array": None}
+
+
+def publish_shared_data(path=SHARED_DATA):
+    """
+    Runs the pipeline and atomically replaces the shared daily index
+    file, so readers see either the old or the new version, never a
+    partial write.
+    """
+    daily_index = load_api_data()
+    records = np.empty(len(daily_index), dtype=SHARED_DTYPE)
+    records["date"] = pd.to_datetime(daily_index["date"]).to_numpy()
+    records["daily_index"] = daily_index["daily_index"].to_numpy()
+    records["count"] = daily_index["count"].to_numpy()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, records)
+    # mkstemp creates the file 0600; workers may run as another user.
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+    logging.info("Published %d days to %s", len(records), path)
+
+
+def refresh_shared_data(path, blocking):
+    """
+    Republishes the shared file unless another worker is already doing
+    so.  With blocking=False, a busy lock means "keep the current file".
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".lock", "w") as lock:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock, flags)
+        except BlockingIOError:
+            return
+        # Someone else may have published (or failed to) while we
+        # waited for the lock.
+        if not shared_data_is_stale(path) or refresh_backing_off(path):
+            return
+        try:
+            publish_shared_data(path)
+        except Exception:
+            # Record the failed attempt for refresh_backing_off().
+            with open(path + ".failed", "w"):
+                pass
+            raise
+        if os.path.exists(path + ".failed"):
+            os.remove(path + ".failed")
+
+
+def refresh_backing_off(path):
+    """
+    True if a previous version exists and the last refresh failed
+    less than SHARED_RETRY seconds ago.
+    """
+    if not os.path.exists(path):
+        return False
+    try:
+        failed = os.stat(path + ".failed").st_mtime
+    except FileNotFoundError:
+        return False
+    return datetime.datetime.now().timestamp() - failed < SHARED_RETRY
+
+
+def shared_data_is_stale(path):
+    """True if the shared file is missing or older than CACHE_EXPIRE."""
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return True
+    return datetime.datetime.now().timestamp() - mtime > CACHE_EXPIRE
+
+
+def fetch_shared_data(path=SHARED_DATA):
+    """
+    Returns the daily index from the shared memory-mapped file,
+    refreshing it when stale and re-mapping it when another process
+    has swapped in a new version.
+    """
+    if shared_data_is_stale(path) and not refresh_backing_off(path):
+        exists = os.path.exists(path)
+        try:
+            refresh_shared_data(path, blocking=not exists)
+        except Exception:  # pylint: disable=broad-except
+            # Keep serving the previous version if the upstream fails.
+            if not exists:
+                raise
+            logging.exception("Refreshing %s failed, serving previous data", path)
+
+    stat = os.stat(path)
+    version = (stat.st_ino, stat.st_mtime_ns)
+    if shared_map["version"] != version:
+        logging.info("Mapping %s", path)
+        shared_map["array"] = np.load(path, mmap_mode="r")
+        shared_map["version"] = version
+
+    # Columns are views onto the mapping, so every worker reads the
+    # same pages instead of holding its own copy.
+    records = shared_map["array"]
+    return pd.DataFrame(
+        {
+            "date": records["date"],
+            "daily_index": records["daily_index"],
+            "count": records["count"],
+        },
+        copy=False,
+    )
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling.  Returns the positions
+    of the (at most) `threshold` points that best preserve the visual
+    shape of the series.  The first and last points are always kept.
+    """
+    n = len(x)
+    if threshold < 3 or threshold >= n:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    bucket_size = (n - 2) / (threshold - 2)
+
+    selected = np.empty(threshold, dtype="int64")
+    selected[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+
+        # Average of the next bucket is the third vertex of the triangle.
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+
+    return selected
+
+
+def decimate_overview(di, visible_start, threshold=OVERVIEW_POINTS):
+    """
+    Keeps every row of the daily index from `visible_start` onwards
+    and LTTB-downsamples the older rows to `threshold` points, so the
+    rangeslider overview stays bounded as the history grows.
+    """
+    dates = pd.to_datetime(di["date"])
+    older = dates < pd.Timestamp(visible_start)
+    if older.sum() <= threshold:
+        return di
+
+    head = di[older.to_numpy()]
+    keep = lttb_indices(
+        dates[older].to_numpy().astype("int64"), head["daily_index"], threshold
+    )
+    return pd.concat([head.iloc[keep], di[~older.to_numpy()]])
+
+
 def fetch_data():
     """
-    Fetches preprocessed data from cache,
+    Fetches preprocessed data from cache (or the shared file),
     or triggers an API request + preprocessing.
     """
+    if SHARED_DATA:
+        return fetch_shared_data()
+
     logging.info("Calling fetch_api_data()")
 
     return fetch_api_data()
@@ -6,11 +6,21 @@ GUI for app
 import os
 from datetime import datetime
 from dash import dcc, html
+from static_assets import asset_url
 import luts
 
 # For hosting
 path_prefix = os.getenv("DASH_REQUESTS_PATHNAME_PREFIX") or "/"
 
+# Directory written by `flask export`; when set, the page uses those files.
+prerender_dir = os.getenv("DASH_PRERENDER_DIR")
+if prerender_dir:
+    download_href = f"{path_prefix}prerendered/statewide_temperature_daily_index.csv"
+else:
+    download_href = (
+        "statewide-temperature-index/downloads/statewide_temperature_daily_index.csv"
+    )
+
 
 # Helper functions
 def wrap_in_section(content, section_classes="", container_classes="", div_classes=""):
@@ -49,7 +59,7 @@ header = html.Div(
                             href="https://uaf-accap.org",
                             children=[
                                 html.Img(
-                                    src=f"{path_prefix}assets/ACCAP_wide.svg",
+                                    src=path_prefix + asset_url("ACCAP_wide.svg"),
                                     alt="Alaska Center for Climate Assessment and Preparedness (ACCAP)",
                                 )
                             ],
@@ -79,7 +89,7 @@ about = wrap_in_section(
                     [
                         "Click the ",
                         html.Img(
-                            src=f"{path_prefix}assets/camera.svg",
+                            src=path_prefix + asset_url("camera.svg"),
                             alt="camera",
                             className="icon",
                             style={
@@ -119,7 +129,7 @@ daily_index = wrap_in_section(
                 html.A(
                     "Download data",
                     className="button is-link",
-                    href="statewide-temperature-index/downloads/statewide_temperature_daily_index.csv",
+                    href=download_href,
                 )
             ],
         ),
@@ -170,7 +180,7 @@ tool_info = wrap_in_section(
                 html.Img(
                     height="480px",
                     width="600px",
-                    src=path_prefix + "assets/asos_station_map.png",
+                    src=path_prefix + asset_url("asos_station_map.png"),
                     alt="Map of the ASOS stations used to determine the Statewide Temperature Index",
                 ),
                 html.Figcaption(
@@ -234,7 +244,7 @@ footer = html.Footer(
                     className="wrapper is-size-6",
                     children=[
                         html.Img(
-                            src=f"{path_prefix}assets/UAF.svg",
+                            src=path_prefix + asset_url("UAF.svg"),
                             alt="University of Alaska Fairbanks (UAF)",
                         ),
                         html.Div(
@@ -0,0 +1,28 @@
+# pylint: disable=C0103
+"""
+Gunicorn settings.  Gunicorn picks this file up from the working
+directory, e.g. `gunicorn application:application`.
+"""
+
+import logging
+
+# Import the app once in the master so workers share its pages
+# copy-on-write instead of each loading it separately.
+preload_app = True
+
+
+def on_starting(server):  # pylint: disable=W0613
+    """
+    With DASH_SHARED_DATA set, publish the daily index before forking
+    so workers start by mapping the same file rather than racing to
+    build it.  If that fails, start anyway and let the workers retry.
+    """
+    import data  # pylint: disable=C0415
+
+    if data.SHARED_DATA and data.shared_data_is_stale(data.SHARED_DATA):
+        try:
+            data.refresh_shared_data(data.SHARED_DATA, blocking=True)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception(
+                "Publishing %s failed, workers will retry", data.SHARED_DATA
+            )
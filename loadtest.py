@@ -0,0 +1,419 @@
+# pylint: disable=C0103,C0301,C0415
+"""
+Load test for the chart callback.
+
+Runs the app in a separate process against a local replay of a
+recorded ACIS response (with optional injected latency and errors),
+fires concurrent `_dash-update-component` requests at it and reports
+latency percentiles, throughput and how many times the upstream was
+called.
+
+Record a response once (needs network access):
+
+    pipenv run python loadtest.py --record data/acis-replay.json
+
+then replay it:
+
+    pipenv run python loadtest.py --requests 500 --concurrency 20 \\
+        --upstream-latency 2 --cache-expire 5
+
+Without a recording, `--synthesize` builds a plausible response from
+the station normals instead.
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# The body Dash's renderer POSTs on page load for the chart.
+CALLBACK_PAYLOAD = json.dumps(
+    {
+        "output": "daily-index.figure",
+        "outputs": {"id": "daily-index", "property": "figure"},
+        "inputs": [{"id": "cache_check_input", "property": "value", "value": None}],
+        "changedPropIds": [],
+        "state": [],
+    }
+).encode()
+
+
+def record(path):
+    """Save the live ACIS response for the app's query to `path`."""
+    import data
+
+    _, query = data.acis_query()
+    print(f"Fetching {query}")
+    with urllib.request.urlopen(query) as response:
+        body = response.read()
+    with open(path, "wb") as f:
+        f.write(body)
+    print(f"Wrote {len(body)} bytes to {path}")
+
+
+def synthesize(station_ids, days=732, missing=0.03):
+    """
+    Fake ACIS MultiStnData response: daily max/min temperatures drawn
+    around each station's normals for the app's date range, with some
+    missing ("M") values.
+    """
+    import pandas as pd
+    import data
+
+    start_date, _ = data.acis_query()
+    month_days = pd.date_range(start_date, periods=days, freq="D").strftime("%m-%d")
+
+    normals = pd.read_csv("data/normals.csv", index_col=0)
+    # Normals dates look like 01-31-2020; index them by month-day.
+    normals["month_day"] = normals["date"].str[:5]
+    rng = random.Random(0)
+    stations = []
+    for usw in station_ids:
+        nd = normals[normals["StationName"] == usw].set_index("month_day")
+        rows = []
+        for month_day in month_days:
+            normal = nd.loc[month_day]
+            if rng.random() < missing:
+                rows.append(["M", "M"])
+                continue
+            average = rng.gauss(normal["AveTemp"], normal["AveTempSD"])
+            spread = rng.uniform(4, 12)
+            rows.append([str(round(average + spread)), str(round(average - spread))])
+        stations.append({"meta": {"sids": [f"{usw} 6"]}, "data": rows})
+    return json.dumps({"data": stations}).encode()
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """Serves the same ACIS response to every request, counting calls."""
+
+    daemon_threads = True
+
+    def __init__(self, body, latency, error_rate, port=0):
+        super().__init__(("127.0.0.1", port), ReplayHandler)
+        self.body = body
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/MultiStnData?"
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """Request handler for ReplayServer."""
+
+    def do_GET(self):  # pylint: disable=C0116
+        server = self.server
+        with server.lock:
+            server.calls += 1
+            fail = random.random() < server.error_rate
+            if fail:
+                server.errors += 1
+        time.sleep(server.latency)
+        if fail:
+            self.send_error(503, "Injected upstream error")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(server.body)))
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        pass
+
+
+def serve_in_background(server):
+    """Run `server.serve_forever()` on a daemon thread."""
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+def load_test_app():
+    """
+    The app as served under test: writes its CSV to a temporary
+    directory instead of the tracked downloads/ file.  Also usable as a
+    gunicorn app factory, `loadtest:load_test_app()`.
+    """
+    import application
+
+    application.DOWNLOADS_DIR = tempfile.mkdtemp(prefix="swti-loadtest-")
+    return application.application
+
+
+def app_environment(upstream_url, cache_expire):
+    """Environment pointing the app under test at the replay server."""
+    env = dict(os.environ, ACIS_API_URL=upstream_url)
+    env["DASH_CACHE_EXPIRE"] = str(cache_expire)
+    env.pop("FLASK_DEBUG", None)
+    env.pop("DASH_PRERENDER_DIR", None)
+    return env
+
+
+def free_port():
+    """A currently unused local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app(upstream_url, cache_expire, server, workers, timeout=120):
+    """
+    Start the app against the replay server in a separate process, so
+    it doesn't share this one's GIL with the load generator, and wait
+    until it accepts connections.  Returns (process, base URL).
+    """
+    port = free_port()
+    if server == "gunicorn":
+        command = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--workers",
+            str(workers),
+            "loadtest:load_test_app()",
+        ]
+    else:
+        command = [sys.executable, __file__, "--serve-app", str(port)]
+    process = subprocess.Popen(
+        command,
+        env=app_environment(upstream_url, cache_expire),
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited with status {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                process.terminate()
+                raise RuntimeError(f"App didn't start within {timeout} s")
+            time.sleep(0.2)
+    return process, f"http://127.0.0.1:{port}"
+
+
+def serve_app(port):
+    """Serve the app under test on a threaded werkzeug server."""
+    from werkzeug.serving import run_simple
+
+    run_simple("127.0.0.1", port, load_test_app(), threaded=True)
+
+
+def start_app_in_process(upstream_url, cache_expire):
+    """
+    Import the app configured against the replay server and serve it
+    from a thread in this process.  Returns the base URL.
+    """
+    # data.py reads its configuration at import time.
+    os.environ.update(app_environment(upstream_url, cache_expire))
+    os.environ.pop("FLASK_DEBUG", None)
+    os.environ.pop("DASH_PRERENDER_DIR", None)
+
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, load_test_app(), threaded=True)
+    serve_in_background(server)
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def hit(url):
+    """POST one chart callback, returning (seconds, succeeded)."""
+    request = urllib.request.Request(
+        url, data=CALLBACK_PAYLOAD, headers={"Content-Type": "application/json"}
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            response.read()
+            ok = response.status == 200
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run(url, requests, concurrency, rate):
+    """
+    Send `requests` callbacks from `concurrency` threads, optionally
+    paced to `rate` requests/second.  Returns (latencies, failures,
+    elapsed seconds).
+    """
+
+    def task(i):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return hit(url)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(task, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([seconds for seconds, ok in results if ok])
+    failures = sum(1 for _, ok in results if not ok)
+    return latencies, failures, elapsed
+
+
+def report(latencies, failures, elapsed, upstream):
+    """Print a summary of one run."""
+    total = len(latencies) + failures
+    print(f"requests:      {total} ({failures} failed)")
+    print(f"elapsed:       {elapsed:.2f} s")
+    print(f"throughput:    {total / elapsed:.1f} req/s")
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        print(f"latency p50:   {p50:.0f} ms")
+        print(f"latency p95:   {p95:.0f} ms")
+        print(f"latency p99:   {p99:.0f} ms")
+        print(f"latency max:   {latencies.max() * 1000:.0f} ms")
+    if upstream is not None:
+        print(f"upstream calls: {upstream.calls} ({upstream.errors} injected errors)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--record", metavar="PATH", help="save a live ACIS response to PATH and exit"
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="PATH",
+        default="data/acis-replay.json",
+        help="recorded ACIS response to serve (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--synthesize",
+        action="store_true",
+        help="generate a response from the normals instead of --replay",
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="requests/second, 0 for as fast as possible",
+    )
+    parser.add_argument(
+        "--upstream-latency",
+        type=float,
+        default=0,
+        help="seconds added to every upstream response",
+    )
+    parser.add_argument(
+        "--upstream-error-rate",
+        type=float,
+        default=0,
+        help="fraction of upstream responses that fail with 503",
+    )
+    parser.add_argument(
+        "--cache-expire",
+        type=int,
+        default=43200,
+        help="DASH_CACHE_EXPIRE for the app under test",
+    )
+    parser.add_argument(
+        "--replay-port",
+        type=int,
+        default=0,
+        help="port for the replay server (default: any free port)",
+    )
+    parser.add_argument(
+        "--server",
+        choices=["werkzeug", "gunicorn", "in-process"],
+        default="werkzeug",
+        help="how to run the app under test: a threaded werkzeug server or "
+        "gunicorn in a separate process, or werkzeug on a thread of the load "
+        "generator itself (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="gunicorn workers with --server gunicorn (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--app-url",
+        help="drive an already running app at this base URL instead; point its "
+        "ACIS_API_URL at the replay server printed on startup",
+    )
+    parser.add_argument("--serve-app", metavar="PORT", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve_app:
+        serve_app(args.serve_app)
+        return 0
+
+    if args.record:
+        record(args.record)
+        return 0
+
+    if not args.synthesize and not os.path.exists(args.replay):
+        parser.error(f"{args.replay} not found, use --record or --synthesize")
+
+    upstream = ReplayServer(
+        None, args.upstream_latency, args.upstream_error_rate, args.replay_port
+    )
+    serve_in_background(upstream)
+    print(f"Replaying ACIS responses at {upstream.url}")
+
+    # Set up the app before anything imports data.py here, which reads
+    # the upstream URL and cache expiry from the environment on import.
+    app_process = None
+    if args.app_url:
+        base_url = args.app_url.rstrip("/")
+    elif args.server == "in-process":
+        base_url = start_app_in_process(upstream.url, args.cache_expire)
+
+    if args.synthesize:
+        import data
+
+        upstream.body = synthesize(data.STATION_IDS.split(","))
+    else:
+        with open(args.replay, "rb") as f:
+            upstream.body = f.read()
+
+    if not args.app_url and args.server != "in-process":
+        app_process, base_url = start_app(
+            upstream.url, args.cache_expire, args.server, args.workers
+        )
+
+    url = base_url + "/_dash-update-component"
+
+    try:
+        latencies, failures, elapsed = run(
+            url, args.requests, args.concurrency, args.rate
+        )
+    finally:
+        if app_process is not None:
+            app_process.terminate()
+            app_process.wait()
+    report(latencies, failures, elapsed, upstream)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -85,6 +85,8 @@ plotly_template.layout.yaxis = axis_configs
 fig_download_configs = dict(
     filename="Statewide_Temperature_Index", width="1000", height="650", scale=2
 )
+# Size of the social media preview written by `flask export`
+preview_image_configs = dict(width=1200, height=630, scale=1)
 fig_configs = dict(
     displayModeBar=True,
     showSendToCloud=False,
@@ -0,0 +1,99 @@
+# pylint: disable=C0103
+"""
+Opt-in cProfile sampling for the chart callback and data pipeline.
+
+Disabled unless DASH_PROFILE_DIR is set, in which case functions
+decorated with @profiled are run under cProfile for a sampled fraction
+of requests (or for a single request sending the X-Profile header) and
+the stats are dumped to that directory as .prof files.
+"""
+
+import cProfile
+import functools
+import hmac
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+import flask
+
+PROFILE_DIR = os.getenv("DASH_PROFILE_DIR", default=None)
+PROFILE_SAMPLE_RATE = float(os.getenv("DASH_PROFILE_SAMPLE_RATE", default="0"))
+# Always keep at least the dump just written.
+PROFILE_KEEP = max(1, int(os.getenv("DASH_PROFILE_KEEP", default="50")))
+# Requests sending `X-Profile: <token>` are always profiled.
+PROFILE_TOKEN = os.getenv("DASH_PROFILE_TOKEN", default=None)
+# Distinguishes dumps written by this process in the same second.
+dump_counter = itertools.count()
+
+# Set while a profiler is running on this thread, so nested profiled
+# functions are covered by the outermost one.
+state = threading.local()
+
+
+def should_profile():
+    """
+    Decide once per request (or per call outside a request) whether
+    to profile it.
+    """
+    if not flask.has_request_context():
+        return random.random() < PROFILE_SAMPLE_RATE
+
+    if "profile" not in flask.g:
+        header = flask.request.headers.get("X-Profile")
+        # Constant-time comparison, so the token can't be guessed by
+        # timing; bytes, as compare_digest rejects non-ASCII str.
+        flask.g.profile = bool(
+            PROFILE_TOKEN
+            and hmac.compare_digest((header or "").encode(), PROFILE_TOKEN.encode())
+        ) or (random.random() < PROFILE_SAMPLE_RATE)
+    return flask.g.profile
+
+
+def dump(profile, name):
+    """Write the stats to PROFILE_DIR and drop the oldest dumps."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(
+        PROFILE_DIR,
+        f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(dump_counter):06d}-{name}.prof",
+    )
+    profile.dump_stats(path)
+    logging.info("Wrote profile %s", path)
+
+    # File names start with the timestamp, so they sort oldest first.
+    dumps = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith(".prof"))
+    for old in dumps[: max(0, len(dumps) - PROFILE_KEEP)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, old))
+        except FileNotFoundError:
+            pass  # another worker rotated it first
+
+
+def profiled(func):
+    """
+    Decorator that profiles sampled calls to func.  Returns func
+    unchanged when profiling is off, so there is no overhead.
+    """
+    if not PROFILE_DIR:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(state, "active", False) or not should_profile():
+            return func(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        state.active = True
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            state.active = False
+            # Profiling must never turn a good response into an error.
+            try:
+                dump(profile, func.__name__)
+            except OSError:
+                logging.exception("Writing profile for %s failed", func.__name__)
+
+    return wrapper
@@ -0,0 +1,130 @@
+# pylint: disable=C0103,E0401
+"""
+Fingerprinted, precompressed copies of the files in assets/.
+
+`flask build-assets` copies each asset to dist/ with a content hash in
+its name (e.g. 10_bulma.min.<hash>.css), plus .gz and (if the brotli
+package is installed) .br variants of text files, and records the
+mapping in dist/manifest.json.  Hashed names never change content, so
+they are served with immutable, year-long cache headers.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSETS_DIR = "assets"
+DIST_DIR = "dist"
+MANIFEST = os.path.join(DIST_DIR, "manifest.json")
+
+# Worth compressing; images other than SVG are already compressed.
+TEXT_EXTENSIONS = {".css", ".js", ".svg", ".json", ".txt", ".html"}
+
+# Preferred first.
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def load_manifest():
+    """Original name -> hashed name, empty if assets haven't been built."""
+    try:
+        with open(MANIFEST) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+manifest = load_manifest()
+
+
+def asset_url(name):
+    """
+    Path (without the requests prefix) to serve asset `name` from:
+    the fingerprinted copy when built, else the plain assets/ file.
+    """
+    if name in manifest:
+        return f"{DIST_DIR}/{manifest[name]}"
+    return f"{ASSETS_DIR}/{name}"
+
+
+def stylesheets():
+    """Fingerprinted CSS files, in the order Dash would load them."""
+    return [asset_url(name) for name in sorted(manifest) if name.endswith(".css")]
+
+
+def build():
+    """Rebuild dist/ and its manifest from assets/."""
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    os.makedirs(DIST_DIR)
+    if brotli is None:
+        logging.warning("brotli is not installed, only writing gzip variants")
+
+    built = {}
+    for name in sorted(os.listdir(ASSETS_DIR)):
+        source = os.path.join(ASSETS_DIR, name)
+        if not os.path.isfile(source):
+            continue
+        with open(source, "rb") as f:
+            content = f.read()
+
+        stem, ext = os.path.splitext(name)
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        hashed = f"{stem}.{digest}{ext}"
+        target = os.path.join(DIST_DIR, hashed)
+        with open(target, "wb") as f:
+            f.write(content)
+
+        if ext in TEXT_EXTENSIONS:
+            variants = {".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants[".br"] = brotli.compress(content, quality=11)
+            for suffix, compressed in variants.items():
+                if len(compressed) < len(content):
+                    with open(target + suffix, "wb") as f:
+                        f.write(compressed)
+
+        built[name] = hashed
+        logging.info("%s -> %s", name, hashed)
+
+    with open(MANIFEST, "w") as f:
+        json.dump(built, f, indent=2, sort_keys=True)
+    return built
+
+
+def serve(path):
+    """
+    Send a fingerprinted asset, picking the best precompressed variant
+    the client accepts.
+    """
+    if path not in manifest.values():
+        flask.abort(404)
+
+    accepted = flask.request.accept_encodings
+    filename, encoding = path, None
+    for candidate, suffix in ENCODINGS:
+        if accepted[candidate] and os.path.exists(
+            os.path.join(DIST_DIR, path + suffix)
+        ):
+            filename, encoding = path + suffix, candidate
+            break
+
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    response = flask.send_from_directory(
+        os.path.abspath(DIST_DIR), filename, mimetype=mimetype, conditional=True
+    )
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    response.vary.add("Accept-Encoding")
+    return response